@@ -2,7 +2,14 @@ import sys
 import argparse
 import os
 import datetime
+import math
+import random
+import hashlib
 import subprocess
+import select
+import signal
+import time
+import zlib
 from collections import defaultdict
 
 
@@ -18,6 +25,44 @@ JOBS_DONE_SUBFOLDER_NAME = os.sep.join((JOBS_SUBFOLDER_NAME, 'done'))
 CATALOG_FNAME = 'catalog.txt'
 LOCFILE_EXTENSION = '.loc'
 COMPRESSED_EXTENSION = '.tar.gz'
+STORED_EXTENSION = '.tar'
+STORED_FLAG = 'STORED'
+# files of these types are already compressed and are stored as they are
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.zip', '.7z', '.rar',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.aac', '.ogg', '.flac', '.mp4', '.m4v', '.mkv', '.mov',
+    '.avi', '.webm', '.pdf', '.docx', '.xlsx', '.pptx', '.jar', '.bam',
+    '.cram'))
+ENTROPY_SAMPLES = 3
+ENTROPY_SAMPLE_BYTES = 16 * 1024
+ENTROPY_MIN_FILE_SIZE = 64 * 1024
+# bits per byte above which gzip saves next to nothing
+ENTROPY_THRESHOLD = 7.8
+LAYOUT_FLAT = 1
+LAYOUT_SHARDED = 2
+SHARDED_NAME_TAIL_LENGTH = 64
+MERKLE_FNAME = 'merkle.txt'
+MERKLE_HASH_NAME = 'blake2b'
+MERKLE_MISSING = 'MISSING'
+HASH_BLOCK_SIZE = 1024 * 1024
+PARITY_EXTENSION = '.rs'
+PARITY_BLOCK_SIZE = 1024 * 1024
+ESTIMATES_FNAME = os.sep.join((JOBS_SUBFOLDER_NAME, 'estimates.txt'))
+NODE_JOBS_FNAME = os.sep.join((JOBS_SUBFOLDER_NAME, 'node_{}.txt'))
+ESTIMATE_SAMPLE_FILES = 8
+ESTIMATE_SAMPLE_BYTES = 64 * 1024
+# the time tar spends per file on top of the compression, e.g. opening it
+ESTIMATE_SECONDS_PER_FILE = 0.001
+# the speed of reading and writing the archives, in MB/s, used by default
+ESTIMATE_IO_SPEED = 100.0
+# the runtime assumed for a job without an estimate
+ESTIMATE_DEFAULT_SECONDS = 1.0
+VERIFY_STATE_FNAME = 'verified.txt'
+WATCH_DIRTY_FNAME = os.sep.join((JOBS_SUBFOLDER_NAME, 'dirty.txt'))
+WATCH_PID_FNAME = os.sep.join((JOBS_SUBFOLDER_NAME, 'watch.pid'))
+WATCH_EVENTS = ('close_write', 'create', 'delete',
+                'moved_from', 'moved_to', 'attrib')
 
 
 def do_print(s, same_line=False):
@@ -32,6 +77,25 @@ def exit_error(msg):
     sys.exit(1)
 
 
+# parse a duration such as '90', '90s', '30m', '12h' or '2d' into seconds
+def parse_duration(s):
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    factor = 1
+    value = s
+    if len(value) > 0 and value[-1] in units:
+        factor = units[value[-1]]
+        value = value[:-1]
+    try:
+        seconds = float(value) * factor
+    except ValueError:
+        seconds = -1
+    max_seconds = datetime.timedelta.max.total_seconds()
+    if not (math.isfinite(seconds) and 0 < seconds <= max_seconds):
+        msg = 'invalid duration "{}", use e.g. 90s, 30m, 12h or 2d'
+        raise argparse.ArgumentTypeError(msg.format(s))
+    return seconds
+
+
 def parse_options():
 
     parser = argparse.ArgumentParser()
@@ -68,6 +132,25 @@ def parse_options():
                         default=False,
                         dest='verify_restore')
 
+    parser.add_argument('--verify-sample',
+                        type=float,
+                        action='store',
+                        default=None,
+                        dest='verify_sample')
+
+    parser.add_argument('--verify-budget',
+                        type=parse_duration,
+                        action='store',
+                        default=None,
+                        dest='verify_budget')
+
+    parser.add_argument('--verify-order',
+                        type=str,
+                        action='store',
+                        choices=('stalest', 'random'),
+                        default='stalest',
+                        dest='verify_order')
+
     parser.add_argument('--check-backup-todo',
                         action='store_true',
                         default=False,
@@ -78,6 +161,79 @@ def parse_options():
                         default=False,
                         dest='check_restore_todo')
 
+    parser.add_argument('--layout',
+                        type=int,
+                        action='store',
+                        choices=(LAYOUT_FLAT, LAYOUT_SHARDED),
+                        default=LAYOUT_SHARDED,
+                        dest='layout')
+
+    parser.add_argument('--store-incompressible',
+                        action='store_true',
+                        default=False,
+                        dest='store_incompressible')
+
+    parser.add_argument('--estimate',
+                        action='store_true',
+                        default=False,
+                        dest='estimate')
+
+    parser.add_argument('--io-speed',
+                        type=float,
+                        action='store',
+                        default=ESTIMATE_IO_SPEED,
+                        dest='io_speed')
+
+    parser.add_argument('--split-jobs',
+                        type=int,
+                        action='store',
+                        default=None,
+                        dest='split_jobs')
+
+    parser.add_argument('--watch',
+                        action='store_true',
+                        default=False,
+                        dest='watch')
+
+    parser.add_argument('--watch-interval',
+                        type=float,
+                        action='store',
+                        default=None,
+                        dest='watch_interval')
+
+    parser.add_argument('--build-merkle',
+                        action='store_true',
+                        default=False,
+                        dest='build_merkle')
+
+    parser.add_argument('--compare-merkle',
+                        type=str,
+                        action='store',
+                        default=None,
+                        dest='compare_merkle')
+
+    parser.add_argument('--make-parity',
+                        action='store_true',
+                        default=False,
+                        dest='make_parity')
+
+    parser.add_argument('--data-shards',
+                        type=int,
+                        action='store',
+                        default=16,
+                        dest='data_shards')
+
+    parser.add_argument('--parity-shards',
+                        type=int,
+                        action='store',
+                        default=4,
+                        dest='parity_shards')
+
+    parser.add_argument('--repair',
+                        action='store_true',
+                        default=False,
+                        dest='repair')
+
     parser.add_argument('--include-script',
                         action='store_true',
                         default=False,
@@ -105,6 +261,19 @@ def parse_options():
         options.source = os.path.abspath(options.source)
     if options.destination is not None:
         options.destination = os.path.abspath(options.destination)
+    if options.compare_merkle is not None:
+        options.compare_merkle = os.path.abspath(options.compare_merkle)
+
+    if options.verify_sample is not None:
+        if not 0 < options.verify_sample <= 1:
+            parser.error('--verify-sample must be in the range (0, 1]')
+    if options.watch_interval is not None:
+        if not (math.isfinite(options.watch_interval) and
+                options.watch_interval > 0):
+            parser.error('--watch-interval must be a positive number of '
+                         'seconds')
+    if not (math.isfinite(options.io_speed) and options.io_speed > 0):
+        parser.error('--io-speed must be a positive number of MB/s')
 
     if DEBUG:
         options.verbose = True
@@ -158,7 +327,77 @@ def get_dir_fname(pth):
     return p
 
 
-def get_dir_description(pth):
+# make the path of all files related to a specific directory, relative to
+# the files and job folders and without the extension. The flat layout
+# puts everything into one folder and may give two directories the same
+# name, the sharded layout names the files by a hash of the full path and
+# spreads them over two levels of subfolders.
+def get_dir_relpath(pth, layout):
+    if layout == LAYOUT_FLAT:
+        return get_dir_fname(pth)
+    digest = hashlib.blake2b(os.fsencode(pth), digest_size=16).hexdigest()
+    tail = get_dir_fname(os.path.basename(pth))[:SHARDED_NAME_TAIL_LENGTH]
+    fname = digest
+    if tail != '':
+        fname = fname + '_' + tail
+    return os.sep.join((digest[0:2], digest[2:4], fname))
+
+
+def get_script_relpath(loc_relpath):
+    return loc_relpath[:-len(LOCFILE_EXTENSION)] + '.sh'
+
+
+def makedirs_for(fpath):
+    dirpath = os.path.dirname(fpath)
+    if os.path.isdir(dirpath) is False:
+        os.makedirs(dirpath)
+
+
+# returns the relative paths of the job scripts below a job folder
+def list_job_scripts(script_dir):
+    scripts = []
+    for dirpath, dirnames, fnames in os.walk(script_dir):
+        dirnames.sort()
+        for fname in sorted(fnames):
+            if fname.endswith('.sh'):
+                fpath = os.sep.join((dirpath, fname))
+                scripts.append(os.path.relpath(fpath, script_dir))
+    return scripts
+
+
+def get_entropy(data):
+    entropy = 0.0
+    for i in range(256):
+        n = data.count(bytes((i,)))
+        if n > 0:
+            p = float(n) / len(data)
+            entropy -= p * math.log(p, 2)
+    return entropy
+
+
+# decide by the file type, or by the entropy of a few samples of the
+# file, whether gzip would be wasted on a file
+def is_incompressible(fpath):
+    if os.path.islink(fpath) or not os.path.isfile(fpath):
+        return False
+    if os.path.splitext(fpath)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+    size = os.path.getsize(fpath)
+    if size < ENTROPY_MIN_FILE_SIZE:
+        return False
+    step = (size - ENTROPY_SAMPLE_BYTES) // (ENTROPY_SAMPLES - 1)
+    data = b''
+    try:
+        with open(fpath, 'rb') as ip:
+            for i in range(ENTROPY_SAMPLES):
+                ip.seek(i * step)
+                data += ip.read(ENTROPY_SAMPLE_BYTES)
+    except OSError:
+        return False
+    return get_entropy(data) >= ENTROPY_THRESHOLD
+
+
+def get_dir_description(pth, store_incompressible=False):
     if os.path.isdir(pth) is False:
         raise ValueError
     vals = []
@@ -171,10 +410,149 @@ def get_dir_description(pth):
             vals.append('DIRECTORY\t{}'.format(i))
     for i in sorted(contents.keys()):
         if not os.path.isdir(contents[i]):
-            vals.append('FILE\t{}\t{}'.format(i, contents[i]))
+            val = 'FILE\t{}\t{}'.format(i, contents[i])
+            if store_incompressible and is_incompressible(contents[i]):
+                val = val + '\t' + STORED_FLAG
+            vals.append(val)
     return '\n'.join(vals)
 
 
+def has_stored_files(loc_fpath):
+    if os.path.exists(loc_fpath) is False:
+        return False
+    with open(loc_fpath, 'r') as ip:
+        for line in ip:
+            line = line.rstrip('\n').split('\t')
+            if line[0] == 'FILE' and len(line) == 4 and \
+                    line[3] == STORED_FLAG:
+                return True
+    return False
+
+
+# returns the archives of a directory: the gzip compressed one and, if some
+# of its files were stored without compression, the uncompressed one
+def get_loc_archives(loc_fpath):
+    base = loc_fpath[:-len(LOCFILE_EXTENSION)]
+    archives = [base + COMPRESSED_EXTENSION]
+    if has_stored_files(loc_fpath):
+        archives.append(base + STORED_EXTENSION)
+    return archives
+
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if n < 1024 or unit == 'TB':
+            break
+        n = n / 1024.0
+    return '{:.1f} {}'.format(n, unit)
+
+
+# sum up the sizes of the files of a directory and gzip small samples of
+# the largest ones to estimate how well they compress. The stored files
+# are written as they are and are not sampled.
+def estimate_dir(dirpath, fnames, stored=()):
+    sizes = {}
+    for i in fnames:
+        try:
+            sizes[i] = os.lstat(os.sep.join((dirpath, i))).st_size
+        except OSError:
+            pass
+    input_bytes = sum(sizes.values())
+    stored_bytes = sum(sizes[i] for i in sizes if i in stored)
+
+    sample_bytes = 0
+    sample_compressed = 0
+    sample_seconds = 0.0
+    largest = sorted((i for i in sizes if i not in stored),
+                     key=lambda i: sizes[i], reverse=True)
+    for i in largest[:ESTIMATE_SAMPLE_FILES]:
+        fpath = os.sep.join((dirpath, i))
+        if os.path.islink(fpath) or sizes[i] == 0:
+            continue
+        try:
+            with open(fpath, 'rb') as ip:
+                ip.seek(max(0, sizes[i] // 2 - ESTIMATE_SAMPLE_BYTES // 2))
+                data = ip.read(ESTIMATE_SAMPLE_BYTES)
+        except OSError:
+            continue
+        start = time.time()
+        sample_compressed += len(zlib.compress(data, 6))
+        sample_seconds += time.time() - start
+        sample_bytes += len(data)
+
+    ratio = 1.0
+    if sample_bytes > 0:
+        ratio = min(1.0, float(sample_compressed) / sample_bytes)
+    compressed_bytes = input_bytes - stored_bytes
+    return {'INPUT_BYTES': input_bytes,
+            'INPUT_FILES': len(sizes),
+            'COMPRESSED_INPUT_BYTES': compressed_bytes,
+            'ESTIMATED_OUTPUT_BYTES': int(compressed_bytes * ratio) +
+            stored_bytes,
+            'SAMPLE_BYTES': sample_bytes,
+            'SAMPLE_SECONDS': sample_seconds}
+
+
+# returns {script relative path: (input bytes, output bytes, seconds)}
+def read_job_estimates(destination):
+    estimates_fpath = os.sep.join((destination, ESTIMATES_FNAME))
+    estimates = {}
+    if os.path.exists(estimates_fpath):
+        with open(estimates_fpath, 'r') as ip:
+            for line in ip:
+                line = line.rstrip('\n').split('\t')
+                if len(line) == 4 and not line[0].startswith('#'):
+                    estimates[line[0]] = (int(line[1]),
+                                          int(line[2]),
+                                          float(line[3]))
+    return estimates
+
+
+# returns the gzip speed measured on the samples, or None if unknown, and
+# the I/O speed the estimates were made with, both in bytes per second
+def read_estimate_speeds(destination):
+    estimates_fpath = os.sep.join((destination, ESTIMATES_FNAME))
+    bytes_per_second = None
+    io_bytes_per_second = ESTIMATE_IO_SPEED * 1024 * 1024
+    if os.path.exists(estimates_fpath):
+        with open(estimates_fpath, 'r') as ip:
+            for line in ip:
+                line = line.rstrip('\n').split('\t')
+                if line[0] == '# BYTES_PER_SECOND' and line[1] != 'None':
+                    bytes_per_second = float(line[1])
+                elif line[0] == '# IO_BYTES_PER_SECOND':
+                    io_bytes_per_second = float(line[1])
+    return bytes_per_second, io_bytes_per_second
+
+
+def get_job_seconds(estimates, script_fname):
+    return estimates.get(script_fname,
+                         (0, 0, ESTIMATE_DEFAULT_SECONDS))[2]
+
+
+# every file is read and written once, and the compressed ones are also
+# gzipped on top of that
+def get_estimated_seconds(estimate, bytes_per_second, io_bytes_per_second):
+    seconds = estimate['INPUT_FILES'] * ESTIMATE_SECONDS_PER_FILE
+    seconds += estimate['INPUT_BYTES'] / io_bytes_per_second
+    if bytes_per_second is not None:
+        seconds += estimate['COMPRESSED_INPUT_BYTES'] / bytes_per_second
+    return seconds
+
+
+def write_estimates_file(destination, estimates, bytes_per_second,
+                         io_bytes_per_second):
+    estimates_fpath = os.sep.join((destination, ESTIMATES_FNAME))
+    with open(estimates_fpath, 'w') as op:
+        op.write('# BYTES_PER_SECOND\t{}\n'.format(bytes_per_second))
+        op.write('# IO_BYTES_PER_SECOND\t{}\n'.format(io_bytes_per_second))
+        op.write('# SCRIPT\tINPUT_BYTES\tESTIMATED_OUTPUT_BYTES'
+                 '\tESTIMATED_SECONDS\n')
+        for script_fname, vals in estimates.items():
+            op.write('{}\t{}\t{}\t{:.3f}\n'.format(script_fname, *vals))
+    return estimates_fpath
+
+
 def make_backup_script(loc_fpath=None):
     ipdir = None
     with open(loc_fpath, 'r') as ip:
@@ -185,29 +563,38 @@ def make_backup_script(loc_fpath=None):
                 break
     if ipdir is None:
         exit_error('PATH not found in {}'.format(loc_fpath))
-    opname = loc_fpath[:-len(LOCFILE_EXTENSION)] + COMPRESSED_EXTENSION
-    awk_fnames = ('awk \'BEGIN {{FS="\\t"}}; '
-                  '$1 == "FILE" && NF == 3'
-                  '{{print $2}}\' {}'.format(loc_fpath))
-    tar_cmd = 'tar -czv --files-from=- -f {}'.format(opname)
-    # note: the "" on the next line is required to get the two
-    # spaces required by md5sum spec between the sum and the file name
-    md5_cmd = 'echo `md5sum {} | cut -d \' \' -f 1` "" {} > {}.md5'
-    md5_cmd = md5_cmd.format(opname,
-                             opname.split(os.sep)[-1],
-                             opname)
+    base = loc_fpath[:-len(LOCFILE_EXTENSION)]
+    archives = [('$1 == "FILE" && NF == 3',
+                 'tar -czv',
+                 base + COMPRESSED_EXTENSION)]
+    if has_stored_files(loc_fpath):
+        archives.append(('$1 == "FILE" && NF == 4 && $4 == "{}"'.format(
+                             STORED_FLAG),
+                         'tar -cv',
+                         base + STORED_EXTENSION))
     op = ['#!/bin/bash',
-          'cd {}'.format(ipdir),
-          awk_fnames + ' | ' + tar_cmd,
-          md5_cmd]
+          'cd {}'.format(ipdir)]
+    for awk_filter, tar_args, opname in archives:
+        awk_fnames = ('awk \'BEGIN {{FS="\\t"}}; '
+                      '{}'
+                      '{{print $2}}\' {}'.format(awk_filter, loc_fpath))
+        tar_cmd = '{} --files-from=- -f {}'.format(tar_args, opname)
+        # note: the "" on the next line is required to get the two
+        # spaces required by md5sum spec between the sum and the file name
+        md5_cmd = 'echo `md5sum {} | cut -d \' \' -f 1` "" {} > {}.md5'
+        md5_cmd = md5_cmd.format(opname,
+                                 opname.split(os.sep)[-1],
+                                 opname)
+        op.append(awk_fnames + ' | ' + tar_cmd)
+        op.append(md5_cmd)
     return '\n'.join(op) + '\n'
 
 
-def make_restore_script(fpath=None, destination_dir=None):
-    tar_cmd = 'tar -xvf {} -C .'.format(fpath)
+def make_restore_script(fpaths=None, destination_dir=None):
     op = ['#!/bin/bash',
-          'cd {}'.format(destination_dir),
-          tar_cmd]
+          'cd {}'.format(destination_dir)]
+    for fpath in fpaths:
+        op.append('tar -xvf {} -C .'.format(fpath))
     return '\n'.join(op) + '\n'
 
 
@@ -267,29 +654,35 @@ def ask_to_run_job_scripts_locally(options):
     msg = 'Executing the job scripts from "{}" locally.'
     do_print(msg.format(script_folder_todo))
 
+    # run the longest jobs first if they were estimated
+    estimates = read_job_estimates(options.destination)
+    scripts = list_job_scripts(script_folder_todo)
+    scripts.sort(key=lambda i: get_job_seconds(estimates, i),
+                 reverse=True)
+
     counter = 0
     fails = 0
-    for fname in os.listdir(script_folder_todo):
-        if fname.endswith('.sh'):
-            fpath_todo = os.sep.join((script_folder_todo, fname))
-            fpath_done = os.sep.join((script_folder_done, fname))
-            args = ['bash', fpath_todo]
-            send_op_to = subprocess.DEVNULL
+    for fname in scripts:
+        fpath_todo = os.sep.join((script_folder_todo, fname))
+        fpath_done = os.sep.join((script_folder_done, fname))
+        args = ['bash', fpath_todo]
+        send_op_to = subprocess.DEVNULL
 
-            if options.verbose:
-                print('run "{}"'.format(' '.join(args)))
-                send_op_to = sys.stderr
-
-            ok = subprocess.call(['bash', fpath_todo],
-                                 stdout=send_op_to,
-                                 stderr=send_op_to)
-            if ok == 0:
-                subprocess.call(['mv', fpath_todo, fpath_done],
-                                stdout=send_op_to,
-                                stderr=send_op_to)
-                counter += 1
-            else:
-                fails += 1
+        if options.verbose:
+            print('run "{}"'.format(' '.join(args)))
+            send_op_to = sys.stderr
+
+        ok = subprocess.call(['bash', fpath_todo],
+                             stdout=send_op_to,
+                             stderr=send_op_to)
+        if ok == 0:
+            makedirs_for(fpath_done)
+            subprocess.call(['mv', fpath_todo, fpath_done],
+                            stdout=send_op_to,
+                            stderr=send_op_to)
+            counter += 1
+        else:
+            fails += 1
 
     if fails == 0:
         msg = 'All {} scripts executed successfully.'
@@ -304,6 +697,179 @@ def ask_to_run_job_scripts_locally(options):
     return response
 
 
+def write_catalog(catalog_fpath, source, loc_fnames, tags=None):
+    with open(catalog_fpath, 'w') as op:
+        op.write('# START\n')
+        op.write('# SOURCE\t{}\n'.format(source))
+        if tags is not None:
+            for tag, value in tags.items():
+                op.write('# {}\t{}\n'.format(tag, value))
+        for loc_fname in loc_fnames:
+            op.write(loc_fname + '\n')
+        op.write('# END\n')
+    md5file(catalog_fpath)
+
+
+# returns the .loc file names listed in the catalog, in catalog order
+def read_catalog_entries(catalog_fpath):
+    entries = []
+    with open(catalog_fpath, 'r') as ip:
+        for line in ip:
+            line = line.strip()
+            if line != '' and not line.startswith('#'):
+                entries.append(line)
+    return entries
+
+
+# returns {tag: value} for the '# TAG\tvalue' lines of the catalog other
+# than SOURCE, in catalog order
+def read_catalog_tags(catalog_fpath):
+    tags = {}
+    with open(catalog_fpath, 'r') as ip:
+        for line in ip:
+            line = line.rstrip('\n')
+            if line.startswith('# ') and '\t' in line:
+                tag, value = line[2:].split('\t', 1)
+                if tag != 'SOURCE':
+                    tags[tag] = value
+    return tags
+
+
+def get_layout(catalog_fpath):
+    layout = read_catalog_tags(catalog_fpath).get('LAYOUT', LAYOUT_FLAT)
+    try:
+        layout = int(layout)
+    except ValueError:
+        layout = None
+    if layout not in (LAYOUT_FLAT, LAYOUT_SHARDED):
+        msg = 'unsupported LAYOUT in the catalog file {}'
+        exit_error(msg.format(catalog_fpath))
+    return layout
+
+
+def get_store_incompressible(catalog_fpath):
+    tags = read_catalog_tags(catalog_fpath)
+    return tags.get('STORE_INCOMPRESSIBLE', '0') == '1'
+
+
+def set_catalog_tag(catalog_fpath, tag, value):
+    source = get_root_dir(catalog_fpath)
+    tags = read_catalog_tags(catalog_fpath)
+    tags[tag] = value
+    entries = read_catalog_entries(catalog_fpath)
+    write_catalog(catalog_fpath, source, entries, tags=tags)
+
+
+# write the .loc file and the backup job script for a single directory
+# returns the name of the .loc file and the estimate of the job, if asked
+def write_backup_job(options, dirpath, layout, store_incompressible=False,
+                     estimate=False):
+    loc_fname = get_dir_relpath(dirpath, layout) + LOCFILE_EXTENSION
+    loc_fpath = os.sep.join((options.destination,
+                             FILES_SUBFOLDER_NAME,
+                             loc_fname))
+    makedirs_for(loc_fpath)
+    description = get_dir_description(
+        dirpath, store_incompressible=store_incompressible)
+    if estimate:
+        fnames = []
+        stored = set()
+        for line in description.split('\n'):
+            line = line.split('\t')
+            if line[0] == 'FILE':
+                fnames.append(line[1])
+                if len(line) == 4 and line[3] == STORED_FLAG:
+                    stored.add(line[1])
+        estimate = estimate_dir(dirpath, fnames, stored=stored)
+    else:
+        estimate = None
+    with open(loc_fpath, 'w') as op:
+        op.write(description)
+        if estimate is not None:
+            for i in ('INPUT_BYTES', 'ESTIMATED_OUTPUT_BYTES'):
+                op.write('\n{}\t{}'.format(i, estimate[i]))
+    md5file(loc_fpath)
+
+    script_fname = get_script_relpath(loc_fname)
+    script_fpath = os.sep.join((options.destination,
+                                JOBS_TODO_SUBFOLDER_NAME,
+                                script_fname))
+    makedirs_for(script_fpath)
+    with open(script_fpath, 'w') as op:
+        script = make_backup_script(loc_fpath=loc_fpath)
+        op.write(script)
+    return loc_fname, estimate
+
+
+# predict the runtime of every job from the speed of gzip on the samples
+# and the --io-speed, and write the estimates next to the job scripts
+def write_job_estimates(options, estimates):
+    sample_bytes = sum(i['SAMPLE_BYTES'] for j, i in estimates)
+    sample_seconds = sum(i['SAMPLE_SECONDS'] for j, i in estimates)
+    bytes_per_second = None
+    if sample_bytes > 0 and sample_seconds > 0:
+        bytes_per_second = sample_bytes / sample_seconds
+    io_bytes_per_second = options.io_speed * 1024 * 1024
+
+    rows = {}
+    for script_fname, estimate in estimates:
+        rows[script_fname] = (estimate['INPUT_BYTES'],
+                              estimate['ESTIMATED_OUTPUT_BYTES'],
+                              get_estimated_seconds(estimate,
+                                                    bytes_per_second,
+                                                    io_bytes_per_second))
+    estimates_fpath = write_estimates_file(options.destination, rows,
+                                           bytes_per_second,
+                                           io_bytes_per_second)
+    total_input = sum(i[0] for i in rows.values())
+    total_output = sum(i[1] for i in rows.values())
+    total_seconds = sum(i[2] for i in rows.values())
+
+    msg = ('Estimated to read {} and write {} in {} of job time.'
+           '\nThe estimates for each job are in "{}"')
+    do_print(msg.format(format_bytes(total_input),
+                        format_bytes(total_output),
+                        datetime.timedelta(seconds=int(total_seconds)),
+                        estimates_fpath))
+
+
+# assign the job scripts to nodes longest-first, each to the node with the
+# least estimated work so far, and write one list of scripts per node
+def split_jobs(options):
+    check_dir_existence(options, 'destination', True)
+    n_nodes = options.split_jobs
+    if n_nodes < 1:
+        exit_error('--split-jobs must be at least 1')
+    script_dir_todo = os.sep.join((options.destination,
+                                   JOBS_TODO_SUBFOLDER_NAME))
+    estimates = read_job_estimates(options.destination)
+    if len(estimates) == 0:
+        do_print('No estimates found, every job is given the same weight.')
+
+    def job_seconds(script_fname):
+        return get_job_seconds(estimates, script_fname)
+
+    scripts = list_job_scripts(script_dir_todo)
+    scripts.sort(key=job_seconds, reverse=True)
+    nodes = [[] for i in range(n_nodes)]
+    loads = [0.0] * n_nodes
+    for i in scripts:
+        node = loads.index(min(loads))
+        nodes[node].append(i)
+        loads[node] += job_seconds(i)
+
+    for node, node_scripts in enumerate(nodes):
+        node_fpath = os.sep.join((options.destination,
+                                  NODE_JOBS_FNAME.format(node)))
+        with open(node_fpath, 'w') as op:
+            for i in node_scripts:
+                op.write(os.sep.join((script_dir_todo, i)) + '\n')
+        msg = '{} scripts, {} estimated, written into "{}"'
+        do_print(msg.format(len(node_scripts),
+                            datetime.timedelta(seconds=int(loads[node])),
+                            node_fpath))
+
+
 def prepare_backups(options):
 
     check_source_and_destination(options)
@@ -319,39 +885,32 @@ def prepare_backups(options):
         os.mkdir(os.sep.join((options.destination, i)))
 
     catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
-    with open(catalog_fpath, 'w') as op:
-        op.write('# START\n')
-        op.write('# SOURCE\t{}\n'.format(options.source))
-        for dirpath, dirnames, fnames in os.walk(options.source):
-            loc_fname = get_dir_fname(dirpath) + LOCFILE_EXTENSION
-            op.write(loc_fname + '\n')
-        op.write('# END\n')
-    md5file(catalog_fpath)
+    layout = options.layout
+    loc_fnames = (get_dir_relpath(dirpath, layout) + LOCFILE_EXTENSION
+                  for dirpath, dirnames, fnames in os.walk(options.source))
+    store_incompressible = options.store_incompressible
+    write_catalog(catalog_fpath, options.source, loc_fnames,
+                  tags={'LAYOUT': layout,
+                        'STORE_INCOMPRESSIBLE': int(store_incompressible)})
 
     # write the .loc files and the job scripts to compress the data
     counter = 0
+    estimates = []
     for dirpath, dirnames, fnames in os.walk(options.source):
         do_print(dirpath, same_line=True)
-        loc_fname = get_dir_fname(dirpath) + LOCFILE_EXTENSION
-        loc_fpath = os.sep.join((options.destination,
-                                 FILES_SUBFOLDER_NAME,
-                                 loc_fname))
-        with open(loc_fpath, 'w') as op:
-            description = get_dir_description(dirpath)
-            op.write(description)
-        md5file(loc_fpath)
-
-        script_fname = get_dir_fname(dirpath) + '.sh'
-        script_fpath = os.sep.join((options.destination,
-                                    JOBS_TODO_SUBFOLDER_NAME,
-                                    script_fname))
-        with open(script_fpath, 'w') as op:
-            script = make_backup_script(loc_fpath=loc_fpath)
-            op.write(script)
+        loc_fname, estimate = write_backup_job(
+            options, dirpath, layout,
+            store_incompressible=store_incompressible,
+            estimate=options.estimate)
+        if estimate is not None:
+            estimates.append((get_script_relpath(loc_fname), estimate))
         counter += 1
     msg = '{} directories prepared for backup'.format(counter)
     do_print(msg)
 
+    if options.estimate:
+        write_job_estimates(options, estimates)
+
     # make a copy of this script to the destination folder
     if options.include_script:
         backup_script_fpath = os.path.realpath(__file__)
@@ -364,6 +923,328 @@ def prepare_backups(options):
         md5file(backup_script_copy_path)
 
 
+# add a directory and all of its subdirectories to the dirty set
+def mark_dirty_tree(dirty, dirpath):
+    new = []
+    for d, dirnames, fnames in os.walk(dirpath):
+        if d not in dirty:
+            dirty.add(d)
+            new.append(d)
+    return new
+
+
+# returns the PATH of a .loc file, or None if it cannot be read
+def read_loc_path(loc_fpath):
+    try:
+        with open(loc_fpath, 'r') as ip:
+            for line in ip:
+                line = line.rstrip('\n').split('\t')
+                if line[0] == 'PATH' and len(line) > 1:
+                    return line[1]
+    except OSError:
+        pass
+    return None
+
+
+# full rescan used when the watcher starts and when the inotify event queue
+# has overflowed: a directory is dirty if it or any of its entries changed
+# after its .loc file was written, or if it is in the catalog but no longer
+# exists. The ctime is compared because cp -p, rsync -a and tar keep the
+# old mtime of the files they write.
+def rescan_dirty_dirs(options, dirty, layout):
+    new = []
+    files_dir = os.sep.join((options.destination, FILES_SUBFOLDER_NAME))
+    catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
+    for loc_fname in read_catalog_entries(catalog_fpath):
+        dirpath = read_loc_path(os.sep.join((files_dir, loc_fname)))
+        if dirpath is None or dirpath in dirty:
+            continue
+        if os.path.isdir(dirpath) is False:
+            dirty.add(dirpath)
+            new.append(dirpath)
+
+    for dirpath, dirnames, fnames in os.walk(options.source):
+        if dirpath in dirty:
+            continue
+        loc_fname = get_dir_relpath(dirpath, layout) + LOCFILE_EXTENSION
+        loc_fpath = os.sep.join((files_dir, loc_fname))
+        try:
+            loc_mtime = os.stat(loc_fpath).st_mtime
+        except OSError:
+            loc_mtime = None
+        is_dirty = loc_mtime is None
+        for i in [dirpath] + [os.sep.join((dirpath, f)) for f in fnames]:
+            if is_dirty:
+                break
+            try:
+                is_dirty = os.lstat(i).st_ctime >= loc_mtime
+            except OSError:
+                is_dirty = True
+        if is_dirty:
+            dirty.add(dirpath)
+            new.append(dirpath)
+    return new
+
+
+def read_dirty_dirs(options):
+    dirty_fpath = os.sep.join((options.destination, WATCH_DIRTY_FNAME))
+    dirty = set()
+    if os.path.exists(dirty_fpath):
+        with open(dirty_fpath, 'r') as ip:
+            for line in ip:
+                line = line.rstrip('\n')
+                if line != '':
+                    dirty.add(line)
+    return dirty
+
+
+# write the job scripts for the dirty directories and update the catalog
+def flush_dirty_dirs(options, dirty, layout):
+    if len(dirty) == 0:
+        return 0
+    catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
+    files_dir = os.sep.join((options.destination, FILES_SUBFOLDER_NAME))
+    script_dir_todo = os.sep.join((options.destination,
+                                   JOBS_TODO_SUBFOLDER_NAME))
+    script_dir_done = os.sep.join((options.destination,
+                                   JOBS_DONE_SUBFOLDER_NAME))
+    entries = read_catalog_entries(catalog_fpath)
+    known = set(entries)
+    removed = set()
+    replanned = set()
+    # the estimates are kept up to date if the backup was estimated
+    estimates = None
+    if os.path.exists(os.sep.join((options.destination, ESTIMATES_FNAME))):
+        estimates = read_job_estimates(options.destination)
+        bytes_per_second, io_bytes_per_second = read_estimate_speeds(
+            options.destination)
+    # plan the jobs the same way as the backup was planned
+    store_incompressible = get_store_incompressible(catalog_fpath)
+    counter = 0
+    for dirpath in sorted(dirty):
+        loc_fname = get_dir_relpath(dirpath, layout) + LOCFILE_EXTENSION
+        tar_fname = loc_fname[:-len(LOCFILE_EXTENSION)] + COMPRESSED_EXTENSION
+        script_fname = get_script_relpath(loc_fname)
+        # the old archive checksum must not let --check-backup-todo
+        # accept the new script before it has been executed, and the old
+        # parity file must not let --repair bring the checksum back
+        stored_fname = loc_fname[:-len(LOCFILE_EXTENSION)] + STORED_EXTENSION
+        stale = [os.sep.join((script_dir_done, script_fname))]
+        for i in (tar_fname, stored_fname):
+            stale += [os.sep.join((files_dir, i + '.md5')),
+                      os.sep.join((files_dir, i + PARITY_EXTENSION))]
+        if os.path.isdir(dirpath):
+            if options.verbose:
+                do_print('plan ' + dirpath)
+            loc_fname, estimate = write_backup_job(
+                options, dirpath, layout,
+                store_incompressible=store_incompressible,
+                estimate=estimates is not None)
+            if estimate is not None:
+                estimates[script_fname] = (
+                    estimate['INPUT_BYTES'],
+                    estimate['ESTIMATED_OUTPUT_BYTES'],
+                    get_estimated_seconds(estimate, bytes_per_second,
+                                          io_bytes_per_second))
+            # the directory has no stored files anymore
+            if not has_stored_files(os.sep.join((files_dir, loc_fname))):
+                stale.append(os.sep.join((files_dir, stored_fname)))
+            replanned.add(loc_fname)
+            if loc_fname not in known:
+                known.add(loc_fname)
+                entries.append(loc_fname)
+        else:
+            # the directory was deleted: drop it and its subdirectories
+            # from the catalog, the old archives are left in place
+            if options.verbose:
+                do_print('drop ' + dirpath)
+            stack = [loc_fname]
+            while len(stack) > 0:
+                i = stack.pop()
+                if i in removed or i not in known:
+                    continue
+                removed.add(i)
+                stale.append(os.sep.join((script_dir_todo,
+                                          get_script_relpath(i))))
+                if estimates is not None:
+                    estimates.pop(get_script_relpath(i), None)
+                loc_fpath = os.sep.join((files_dir, i))
+                if os.path.exists(loc_fpath):
+                    stack.extend(get_loc_children(loc_fpath, known, layout))
+        for i in stale:
+            if os.path.exists(i):
+                os.remove(i)
+        counter += 1
+
+    # the recorded Merkle root no longer describes the backup
+    tags = read_catalog_tags(catalog_fpath)
+    tags.pop('MERKLE_ROOT', None)
+    entries = [i for i in entries if i not in removed]
+    write_catalog(catalog_fpath, options.source, entries, tags=tags)
+
+    if estimates is not None:
+        write_estimates_file(options.destination, estimates,
+                             bytes_per_second, io_bytes_per_second)
+
+    # the new archives have not been verified yet
+    state = read_verify_state(options)
+    if len(replanned.intersection(state)) > 0 or \
+            len(removed.intersection(state)) > 0:
+        for i in replanned:
+            state.pop(i, None)
+        write_verify_state(options, state, entries)
+
+    dirty_fpath = os.sep.join((options.destination, WATCH_DIRTY_FNAME))
+    open(dirty_fpath, 'w').close()
+    dirty.clear()
+    return counter
+
+
+def watch_source(options):
+    check_dir_existence(options, 'source', True)
+    check_dir_existence(options, 'destination', True)
+    verify_catalog(options)
+    catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
+    if get_root_dir(catalog_fpath) != options.source:
+        msg = 'the catalog "{}" was not made from the --source "{}"'
+        exit_error(msg.format(catalog_fpath, options.source))
+    layout = get_layout(catalog_fpath)
+
+    # without -q inotifywait reports when all of its watches are set up
+    args = ['inotifywait', '-m', '-r', '--format', '%e\t%w\t%f']
+    for i in WATCH_EVENTS:
+        args += ['-e', i]
+    args.append(options.source)
+    try:
+        proc = subprocess.Popen(args,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+    except OSError:
+        exit_error('--watch requires inotifywait (inotify-tools)')
+
+    pid_fpath = os.sep.join((options.destination, WATCH_PID_FNAME))
+    with open(pid_fpath, 'w') as op:
+        op.write('{}\n'.format(os.getpid()))
+
+    # SIGUSR1 writes the job scripts for the dirty directories on demand
+    flush_requested = [False]
+
+    def request_flush(signum, frame):
+        flush_requested[0] = True
+    signal.signal(signal.SIGUSR1, request_flush)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    dirty = read_dirty_dirs(options)
+    dirty_fpath = os.sep.join((options.destination, WATCH_DIRTY_FNAME))
+    dirty_op = open(dirty_fpath, 'a')
+
+    def add_dirty(dirpaths):
+        for d in dirpaths:
+            dirty_op.write(d + '\n')
+        dirty_op.flush()
+
+    def is_ignored(dirpath):
+        return (dirpath == options.destination or
+                dirpath.startswith(options.destination + os.sep))
+
+    def stop_with_error(err_buf):
+        proc.wait()
+        err_buf += proc.stderr.read()
+        msg = 'inotifywait stopped unexpectedly'
+        err = os.fsdecode(err_buf[-4096:]).strip()
+        if err != '':
+            msg = msg + ':\n' + err
+        exit_error(msg)
+
+    fd = proc.stdout.fileno()
+    err_fd = proc.stderr.fileno()
+    buf = b''
+    err_buf = b''
+    try:
+        do_print('Setting up the inotify watches for "{}".'.format(
+            options.source))
+        while b'Watches established' not in err_buf:
+            chunk = os.read(err_fd, 65536)
+            if chunk == b'':
+                stop_with_error(err_buf)
+            err_buf += chunk
+        err_buf = err_buf.split(b'Watches established', 1)[1]
+
+        # catch up with the changes made before the watches were set up,
+        # e.g. while the watcher was not running
+        do_print('Scanning "{}" for changes made while it was not '
+                 'watched.'.format(options.source))
+        add_dirty(rescan_dirty_dirs(options, dirty, layout))
+
+        msg = ('Watching "{}" for changes (pid {}), {} directories are '
+               'dirty.\nSend SIGUSR1 to write the job scripts for the dirty '
+               'directories.')
+        do_print(msg.format(options.source, os.getpid(), len(dirty)))
+
+        next_flush = None
+        if options.watch_interval is not None:
+            next_flush = time.time() + options.watch_interval
+        while True:
+            ready, _, _ = select.select([fd, err_fd], [], [], 1.0)
+            # keep the end of the error output of inotifywait, e.g. when
+            # it runs out of inotify watches
+            if err_fd in ready:
+                err_buf = (err_buf + os.read(err_fd, 65536))[-4096:]
+            if fd in ready:
+                chunk = os.read(fd, 65536)
+                if chunk == b'':
+                    stop_with_error(err_buf)
+                buf += chunk
+                lines = buf.split(b'\n')
+                buf = lines.pop()
+                overflow = False
+                for line in lines:
+                    line = os.fsdecode(line).split('\t')
+                    if 'Q_OVERFLOW' in line[0]:
+                        overflow = True
+                        continue
+                    if len(line) != 3:
+                        continue
+                    events = set(line[0].split(','))
+                    dirpath = line[1].rstrip(os.sep)
+                    if is_ignored(dirpath):
+                        continue
+                    new = []
+                    if dirpath not in dirty:
+                        dirty.add(dirpath)
+                        new.append(dirpath)
+                    if line[2] != '' and 'ISDIR' in events:
+                        sub_path = os.sep.join((dirpath, line[2]))
+                        if events & {'CREATE', 'MOVED_TO'}:
+                            new += mark_dirty_tree(dirty, sub_path)
+                        elif sub_path not in dirty:
+                            dirty.add(sub_path)
+                            new.append(sub_path)
+                    add_dirty(new)
+                if overflow:
+                    do_print('The inotify event queue overflowed, '
+                             'rescanning "{}".'.format(options.source))
+                    add_dirty(rescan_dirty_dirs(options, dirty, layout))
+
+            now = time.time()
+            if next_flush is not None and now >= next_flush:
+                flush_requested[0] = True
+                next_flush = now + options.watch_interval
+            if flush_requested[0]:
+                flush_requested[0] = False
+                counter = flush_dirty_dirs(options, dirty, layout)
+                msg = '{} directories prepared for backup'.format(counter)
+                do_print(msg)
+    except KeyboardInterrupt:
+        do_print('Stopped watching, {} directories are dirty.'.format(
+            len(dirty)))
+    finally:
+        proc.terminate()
+        dirty_op.close()
+        if os.path.exists(pid_fpath):
+            os.remove(pid_fpath)
+
+
 def verify_catalog(options):
     do_print('Verifying that the catalog file is intact and present.')
     catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
@@ -405,11 +1286,15 @@ def verify_catalog(options):
 
 def verify_backups(options):
 
+    if options.verify_sample is not None or options.verify_budget is not None:
+        return verify_backups_sample(options)
+
     verify_catalog(options)
     do_print('Verifying that the backed up files exist and are intact.')
 
     # verify all md5sums
     md5sums = []
+    entries = []
     catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
     with open(catalog_fpath, 'r') as ip:
         for line in ip:
@@ -418,13 +1303,9 @@ def verify_backups(options):
                 loc_fpath = os.sep.join((options.destination,
                                          FILES_SUBFOLDER_NAME,
                                          line))
-                tar_fname = line[:-len(LOCFILE_EXTENSION)]
-                tar_fname = tar_fname + COMPRESSED_EXTENSION
-                tar_fpath = os.sep.join((options.destination,
-                                         FILES_SUBFOLDER_NAME,
-                                         tar_fname))
-                md5sums.append(loc_fpath)
-                md5sums.append(tar_fpath)
+                fpaths = [loc_fpath] + get_loc_archives(loc_fpath)
+                md5sums.extend(fpaths)
+                entries.append((line, fpaths))
 
     fails = []
     for i in md5sums:
@@ -436,17 +1317,721 @@ def verify_backups(options):
         if options.verbose:
             msg = 'md5sum check {}: {}'.format(i, word)
             do_print(msg)
+
+    now = time.time()
+    state = read_verify_state(options)
+    failed = set(fails)
+    for line, fpaths in entries:
+        if len(failed.intersection(fpaths)) == 0:
+            state[line] = now
+
+    # the verification times are saved after the result is reported
+    try:
+        if len(fails) > 0:
+            for i in fails:
+                msg = 'md5sum fail for {}'.format(i)
+                do_print(msg)
+            msg = '{} md5sum fails.\nBackup verification: FAILURE'
+            exit_error(msg.format(len(fails)))
+        else:
+            msg = ('All {} md5sums (2 per compressed directory, 1 more for '
+                   'stored files) matched.')
+            do_print(msg.format(len(md5sums)))
+
+        do_print('Backup verification: SUCCESS')
+    finally:
+        save_verify_state(options, state, [i[0] for i in entries])
+    return 0
+
+
+# returns {loc_fname: time of the last successful verification}
+def read_verify_state(options):
+    state_fpath = os.sep.join((options.destination, VERIFY_STATE_FNAME))
+    state = {}
+    if os.path.exists(state_fpath):
+        with open(state_fpath, 'r') as ip:
+            for line in ip:
+                line = line.rstrip('\n').split('\t')
+                if len(line) == 2:
+                    state[line[0]] = float(line[1])
+    return state
+
+
+def write_verify_state(options, state, entries):
+    state_fpath = os.sep.join((options.destination, VERIFY_STATE_FNAME))
+    tmp_fpath = state_fpath + '.tmp'
+    with open(tmp_fpath, 'w') as op:
+        for i in entries:
+            if i in state:
+                op.write('{}\t{}\n'.format(i, state[i]))
+    os.replace(tmp_fpath, state_fpath)
+
+
+# a read-only --destination can be verified, only its times are not saved
+def save_verify_state(options, state, entries):
+    try:
+        write_verify_state(options, state, entries)
+    except OSError as e:
+        msg = 'Warning: the verification times could not be saved: {}'
+        do_print(msg.format(e))
+
+
+# verify a part of the archives per run, the ones verified longest ago
+# first, so that repeated runs cover the whole backup
+def verify_backups_sample(options):
+
+    verify_catalog(options)
+    catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
+    files_dir = os.sep.join((options.destination, FILES_SUBFOLDER_NAME))
+    entries = read_catalog_entries(catalog_fpath)
+    state = read_verify_state(options)
+
+    queue = list(entries)
+    if options.verify_order == 'random':
+        random.shuffle(queue)
+    else:
+        queue.sort(key=lambda i: state.get(i, 0))
+    if options.verify_sample is not None:
+        queue = queue[:int(math.ceil(options.verify_sample * len(queue)))]
+
+    msg = 'Verifying up to {} of {} backed up directories'
+    msg = msg.format(len(queue), len(entries))
+    if options.verify_budget is not None:
+        budget = datetime.timedelta(seconds=int(options.verify_budget))
+        msg = msg + ' within {}'.format(budget)
+    do_print(msg + '.')
+
+    start = time.time()
+    checked = 0
+    fails = []
+    # the verification times are saved after the result is reported, or
+    # when the run is interrupted
+    try:
+        for i in queue:
+            if options.verify_budget is not None and \
+                    time.time() - start >= options.verify_budget:
+                break
+            loc_fpath = os.sep.join((files_dir, i))
+            i_fails = verify_locfile_backup(loc_fpath)
+            if options.verbose:
+                word = 'fail' if len(i_fails) > 0 else 'pass'
+                do_print('md5sum check {}: {}'.format(loc_fpath, word))
+            if len(i_fails) == 0:
+                state[i] = time.time()
+            fails.extend(i_fails)
+            checked += 1
+        report_verify_sample(options, state, entries, checked, start, fails)
+    finally:
+        save_verify_state(options, state, entries)
+    return 0
+
+
+def report_verify_sample(options, state, entries, checked, start, fails):
+    now = time.time()
+    verified = [state[i] for i in entries if i in state]
+    msg = ('Checked {} directories in {}.'
+           '\nCoverage: {} of {} directories ({:.1f}%) have been verified.')
+    do_print(msg.format(checked,
+                        datetime.timedelta(seconds=int(now - start)),
+                        len(verified), len(entries),
+                        100.0 * len(verified) / max(1, len(entries))))
+    if len(verified) < len(entries):
+        msg = '{} directories have never been verified.'
+        do_print(msg.format(len(entries) - len(verified)))
+    if len(verified) > 0:
+        msg = 'The least recently verified directory was verified {} ago.'
+        age = datetime.timedelta(seconds=int(now - min(verified)))
+        do_print(msg.format(age))
+
     if len(fails) > 0:
         for i in fails:
-            msg = 'md5sum fail for {}'.format(i)
-            do_print(msg)
+            do_print('md5sum fail for {}'.format(i))
         msg = '{} md5sum fails.\nBackup verification: FAILURE'
         exit_error(msg.format(len(fails)))
-    else:
-        msg = 'All {} md5sums (2 per compressed directory) matched.'
-        do_print(msg.format(len(md5sums)))
-
     do_print('Backup verification: SUCCESS')
+
+
+def hash_file(fpath):
+    if os.path.exists(fpath) is False:
+        return MERKLE_MISSING
+    h = hashlib.blake2b()
+    with open(fpath, 'rb') as ip:
+        while True:
+            block = ip.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+# a node covers the directory's .loc file, its archive and its children
+def get_merkle_node_hash(loc_hash, archive_hash, children):
+    h = hashlib.blake2b()
+    h.update('{}\t{}\n'.format(loc_hash, archive_hash).encode('utf-8'))
+    for name, node_hash in sorted(children):
+        h.update('{}\t{}\n'.format(name, node_hash).encode('utf-8'))
+    return h.hexdigest()
+
+
+# returns the catalog entries of the subdirectories listed in a .loc file
+def get_loc_children(loc_fpath, known, layout):
+    source_dir = None
+    dirnames = []
+    with open(loc_fpath, 'r') as ip:
+        for line in ip:
+            line = line.rstrip('\n').split('\t')
+            if line[0] == 'PATH':
+                source_dir = line[1]
+            if line[0] == 'DIRECTORY':
+                dirnames.append(line[1])
+    if source_dir is None:
+        exit_error('PATH not found in {}'.format(loc_fpath))
+    children = []
+    for i in dirnames:
+        child = get_dir_relpath(os.sep.join((source_dir, i)), layout)
+        child = child + LOCFILE_EXTENSION
+        if child in known:
+            children.append(child)
+    return children
+
+
+def build_merkle_tree(options):
+    check_dir_existence(options, 'destination', True)
+    verify_catalog(options)
+    do_print('Hashing the .loc files and the archives.')
+
+    catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
+    files_dir = os.sep.join((options.destination, FILES_SUBFOLDER_NAME))
+    entries = read_catalog_entries(catalog_fpath)
+    known = set(entries)
+    layout = get_layout(catalog_fpath)
+
+    leaves = {}
+    children = {}
+    for loc_fname in entries:
+        loc_fpath = os.sep.join((files_dir, loc_fname))
+        if options.verbose:
+            do_print('hash ' + loc_fpath)
+        archive_hashes = [hash_file(i) for i in get_loc_archives(loc_fpath)]
+        archive_hash = archive_hashes[0]
+        if MERKLE_MISSING in archive_hashes:
+            archive_hash = MERKLE_MISSING
+        elif len(archive_hashes) > 1:
+            h = hashlib.blake2b('\t'.join(archive_hashes).encode('utf-8'))
+            archive_hash = h.hexdigest()
+        leaves[loc_fname] = (hash_file(loc_fpath), archive_hash)
+        if leaves[loc_fname][0] == MERKLE_MISSING:
+            children[loc_fname] = []
+        else:
+            children[loc_fname] = get_loc_children(loc_fpath, known,
+                                                   layout)
+
+    # compute the node hashes bottom-up without recursion, the trees
+    # can be deeper than the recursion limit
+    nodes = {}
+    for start in entries:
+        stack = [start]
+        while len(stack) > 0:
+            loc_fname = stack[-1]
+            if loc_fname in nodes:
+                stack.pop()
+                continue
+            pending = [i for i in children[loc_fname] if i not in nodes]
+            if len(pending) > 0:
+                stack.extend(pending)
+                continue
+            loc_hash, archive_hash = leaves[loc_fname]
+            node_children = [(i, nodes[i]) for i in children[loc_fname]]
+            nodes[loc_fname] = get_merkle_node_hash(loc_hash,
+                                                    archive_hash,
+                                                    node_children)
+            stack.pop()
+
+    root = get_dir_relpath(get_root_dir(catalog_fpath), layout)
+    root = root + LOCFILE_EXTENSION
+    if root not in nodes:
+        exit_error('the root directory {} is not in the catalog'.format(root))
+
+    merkle_fpath = os.sep.join((options.destination, MERKLE_FNAME))
+    with open(merkle_fpath, 'w') as op:
+        op.write('# START\n')
+        op.write('# HASH\t{}\n'.format(MERKLE_HASH_NAME))
+        op.write('# ROOT\t{}\t{}\n'.format(root, nodes[root]))
+        for loc_fname in entries:
+            vals = [loc_fname, nodes[loc_fname]]
+            vals.extend(leaves[loc_fname])
+            vals.extend(children[loc_fname])
+            op.write('\t'.join(vals) + '\n')
+        op.write('# END\n')
+    md5file(merkle_fpath)
+    set_catalog_tag(catalog_fpath, 'MERKLE_ROOT', nodes[root])
+
+    missing = [i for i in entries if MERKLE_MISSING in leaves[i]]
+    if len(missing) > 0:
+        msg = 'WARNING: {} directories are missing the .loc file or archive'
+        do_print(msg.format(len(missing)))
+    do_print('Merkle root {} written into "{}"'.format(nodes[root],
+                                                       catalog_fpath))
+
+
+# returns (root_entry, root_hash, {entry: (node, loc, archive, children)})
+def read_merkle_tree(destination):
+    merkle_fpath = os.sep.join((destination, MERKLE_FNAME))
+    if os.path.exists(merkle_fpath) is False:
+        msg = 'the Merkle tree "{}" is missing, run --build-merkle first'
+        exit_error(msg.format(merkle_fpath))
+    if md5check(merkle_fpath) is False:
+        exit_error('md5sum fail for {}'.format(merkle_fpath))
+    root = None
+    root_hash = None
+    nodes = {}
+    with open(merkle_fpath, 'r') as ip:
+        for line in ip:
+            line = line.rstrip('\n').split('\t')
+            if line[0] == '# HASH' and line[1] != MERKLE_HASH_NAME:
+                msg = 'unsupported hash {} in "{}"'
+                exit_error(msg.format(line[1], merkle_fpath))
+            if line[0] == '# ROOT':
+                root, root_hash = line[1], line[2]
+            if not line[0].startswith('#'):
+                nodes[line[0]] = (line[1], line[2], line[3], line[4:])
+    if root is None or root not in nodes:
+        exit_error('ROOT not found in {}'.format(merkle_fpath))
+
+    catalog_fpath = os.sep.join((destination, CATALOG_FNAME))
+    if read_catalog_tags(catalog_fpath).get('MERKLE_ROOT') != root_hash:
+        msg = ('the Merkle root in "{}" does not match "{}", '
+               'run --build-merkle again')
+        exit_error(msg.format(catalog_fpath, merkle_fpath))
+    return root, root_hash, nodes
+
+
+def compare_merkle_trees(options):
+    check_dir_existence(options, 'destination', True)
+    _check_dir_existence(description='compare-merkle',
+                         fpath=options.compare_merkle,
+                         expected=True)
+    do_print('Comparing "{}" with "{}"'.format(options.destination,
+                                               options.compare_merkle))
+
+    # identical roots need nothing more than the two catalogs
+    roots = []
+    for i in (options.destination, options.compare_merkle):
+        catalog_fpath = os.sep.join((i, CATALOG_FNAME))
+        if os.path.exists(catalog_fpath) is False:
+            exit_error('the catalog file "{}" is missing'.format(
+                catalog_fpath))
+        roots.append(read_catalog_tags(catalog_fpath).get('MERKLE_ROOT'))
+    if None in roots:
+        exit_error('no Merkle root in the catalog, run --build-merkle first')
+    if roots[0] == roots[1]:
+        do_print('The Merkle roots {} match.'.format(roots[0]))
+        do_print('Comparison: SUCCESS')
+        return 0
+
+    # descend only into the subtrees whose node hashes differ
+    root, root_hash, nodes_a = read_merkle_tree(options.destination)
+    other_root, other_root_hash, nodes_b = \
+        read_merkle_tree(options.compare_merkle)
+    if root != other_root:
+        msg = 'the copies were made from different directories: {} and {}'
+        exit_error(msg.format(root, other_root))
+
+    diffs = []
+    visited = 0
+    queue = [root]
+    while len(queue) > 0:
+        loc_fname = queue.pop()
+        visited += 1
+        a = nodes_a.get(loc_fname)
+        b = nodes_b.get(loc_fname)
+        if a is None or b is None:
+            where = options.compare_merkle if b is None \
+                else options.destination
+            diffs.append((loc_fname, 'missing from "{}"'.format(where)))
+            continue
+        if a[0] == b[0]:
+            continue
+        if a[1] != b[1]:
+            diffs.append((loc_fname, '.loc differs'))
+        if a[2] != b[2]:
+            diffs.append((loc_fname, 'archive differs'))
+        for i in sorted(set(a[3]) | set(b[3])):
+            queue.append(i)
+
+    for loc_fname, what in diffs:
+        do_print('{}: {}'.format(loc_fname, what))
+    msg = ('Compared {} of {} directory nodes, {} differences found.'
+           '\nComparison: FAILURE')
+    exit_error(msg.format(visited, len(nodes_a), len(diffs)))
+
+
+# Reed-Solomon erasure coding over GF(256). Each archive is split into
+# k data shards and m parity shards are computed with a Cauchy matrix, so
+# that any k intact shards out of the k + m are enough to rebuild the
+# archive. The intact shards are told apart by their BLAKE2b hashes.
+class GF256(object):
+
+    def __init__(self):
+        try:
+            import numpy
+        except ImportError:
+            exit_error('the parity options require numpy')
+        self.np = numpy
+        exp = [0] * 512
+        log = [0] * 256
+        x = 1
+        for i in range(255):
+            exp[i] = x
+            log[x] = i
+            x <<= 1
+            if x & 0x100:
+                x ^= 0x11d
+        for i in range(255, 512):
+            exp[i] = exp[i - 255]
+        self.exp = exp
+        self.log = log
+        # mul[a] maps every byte b to a * b
+        nonzero = numpy.arange(1, 256)
+        log_arr = numpy.array(log, dtype=numpy.int64)
+        exp_arr = numpy.array(exp, dtype=numpy.uint8)
+        self.mul = numpy.zeros((256, 256), dtype=numpy.uint8)
+        for a in range(1, 256):
+            self.mul[a, 1:] = exp_arr[log[a] + log_arr[nonzero]]
+
+    def inv(self, a):
+        return self.exp[255 - self.log[a]]
+
+    def mul_scalar(self, a, b):
+        if a == 0 or b == 0:
+            return 0
+        return self.exp[self.log[a] + self.log[b]]
+
+    # the m x k parity rows of the systematic encoding matrix
+    def cauchy_matrix(self, k, m):
+        return [[self.inv((k + i) ^ j) for j in range(k)] for i in range(m)]
+
+    # multiply a matrix of field elements with the rows of a byte array
+    def matmul(self, matrix, data):
+        out = self.np.zeros((len(matrix), data.shape[1]), dtype=self.np.uint8)
+        for r, row in enumerate(matrix):
+            for c, coef in enumerate(row):
+                if coef == 1:
+                    out[r] ^= data[c]
+                elif coef != 0:
+                    out[r] ^= self.mul[coef][data[c]]
+        return out
+
+    def invert_matrix(self, matrix):
+        n = len(matrix)
+        a = [list(row) + [int(i == j) for j in range(n)]
+             for i, row in enumerate(matrix)]
+        for col in range(n):
+            pivot = None
+            for r in range(col, n):
+                if a[r][col] != 0:
+                    pivot = r
+                    break
+            if pivot is None:
+                raise ValueError('singular matrix')
+            a[col], a[pivot] = a[pivot], a[col]
+            f = self.inv(a[col][col])
+            a[col] = [self.mul_scalar(f, v) for v in a[col]]
+            for r in range(n):
+                if r != col and a[r][col] != 0:
+                    f = a[r][col]
+                    a[r] = [v ^ self.mul_scalar(f, w)
+                            for v, w in zip(a[r], a[col])]
+        return [row[n:] for row in a]
+
+
+def read_md5_sidecar(fpath):
+    with open(fpath + '.md5', 'r') as ip:
+        return ip.read().split()[0]
+
+
+# returns the header of a parity file and the offset of the parity shards
+def read_parity_header(parity_fpath):
+    header = {'SHARD': {}}
+    with open(parity_fpath, 'rb') as ip:
+        for line in ip:
+            line = line.decode('utf-8').rstrip('\n').split('\t')
+            if line[0] == '# END':
+                return header, ip.tell()
+            if line[0] == 'SHARD':
+                header['SHARD'][int(line[1])] = line[2]
+            elif not line[0].startswith('#'):
+                header[line[0]] = line[1]
+    raise ValueError('END not found in {}'.format(parity_fpath))
+
+
+# read one block of every data shard, padding the end of the archive
+def read_data_block(gf, ip, size, shard_size, offset, length, k):
+    block = gf.np.zeros((k, length), dtype=gf.np.uint8)
+    for i in range(k):
+        start = i * shard_size + offset
+        if start >= size:
+            continue
+        ip.seek(start)
+        data = ip.read(min(length, size - start))
+        block[i, :len(data)] = gf.np.frombuffer(data, dtype=gf.np.uint8)
+    return block
+
+
+def make_parity_header(size, k, m, shard_size, archive_md5, hashes):
+    vals = ['# RS_PARITY',
+            'SIZE\t{}'.format(size),
+            'DATA_SHARDS\t{}'.format(k),
+            'PARITY_SHARDS\t{}'.format(m),
+            'SHARD_SIZE\t{}'.format(shard_size),
+            'ARCHIVE_MD5\t{}'.format(archive_md5)]
+    for i, h in enumerate(hashes):
+        vals.append('SHARD\t{}\t{}'.format(i, h))
+    vals.append('# END')
+    return ('\n'.join(vals) + '\n').encode('utf-8')
+
+
+def write_parity_file(options, gf, tar_fpath):
+    k = options.data_shards
+    m = options.parity_shards
+    size = os.path.getsize(tar_fpath)
+    shard_size = max(1, -(-size // k))
+    cauchy = gf.cauchy_matrix(k, m)
+    hashes = [hashlib.blake2b() for i in range(k + m)]
+    archive_md5 = hashlib.md5()
+
+    # the header has a fixed length, it is written again once the
+    # hashes are known
+    header = make_parity_header(size, k, m, shard_size,
+                                '0' * archive_md5.digest_size * 2,
+                                ['0' * h.digest_size * 2 for h in hashes])
+    parity_fpath = tar_fpath + PARITY_EXTENSION
+    tmp_fpath = parity_fpath + '.tmp'
+    with open(tar_fpath, 'rb') as ip, open(tmp_fpath, 'wb') as op:
+        for offset in range(0, shard_size, PARITY_BLOCK_SIZE):
+            length = min(PARITY_BLOCK_SIZE, shard_size - offset)
+            data = read_data_block(gf, ip, size, shard_size,
+                                   offset, length, k)
+            parity = gf.matmul(cauchy, data)
+            for i in range(k):
+                hashes[i].update(data[i].tobytes())
+            for i in range(m):
+                hashes[k + i].update(parity[i].tobytes())
+                op.seek(len(header) + i * shard_size + offset)
+                op.write(parity[i].tobytes())
+        ip.seek(0)
+        while True:
+            block = ip.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            archive_md5.update(block)
+        op.seek(0)
+        op.write(make_parity_header(size, k, m, shard_size,
+                                    archive_md5.hexdigest(),
+                                    [h.hexdigest() for h in hashes]))
+
+    if archive_md5.hexdigest() != read_md5_sidecar(tar_fpath):
+        os.remove(tmp_fpath)
+        return False
+    os.replace(tmp_fpath, parity_fpath)
+    return True
+
+
+# returns the archives listed in the catalog of the --destination
+def list_archives(options):
+    catalog_fpath = os.sep.join((options.destination, CATALOG_FNAME))
+    files_dir = os.sep.join((options.destination, FILES_SUBFOLDER_NAME))
+    archives = []
+    for loc_fname in read_catalog_entries(catalog_fpath):
+        loc_fpath = os.sep.join((files_dir, loc_fname))
+        archives.extend(get_loc_archives(loc_fpath))
+    return archives
+
+
+def make_parity(options):
+    check_dir_existence(options, 'destination', True)
+    verify_catalog(options)
+    k = options.data_shards
+    m = options.parity_shards
+    if k < 1 or m < 1 or k + m > 256:
+        exit_error('--data-shards and --parity-shards must be positive '
+                   'and at most 256 in total')
+    gf = GF256()
+    msg = 'Writing {} parity shards for every {} data shards.'
+    do_print(msg.format(m, k))
+
+    counter = 0
+    fails = []
+    for tar_fpath in list_archives(options):
+        if not os.path.exists(tar_fpath + '.md5'):
+            continue
+        # parity files made from the same archive are kept, parity files
+        # with a damaged header are written again
+        parity_fpath = tar_fpath + PARITY_EXTENSION
+        if os.path.exists(parity_fpath):
+            try:
+                header, offset = read_parity_header(parity_fpath)
+                archive_md5 = read_md5_sidecar(tar_fpath)
+                up_to_date = (header.get('ARCHIVE_MD5') == archive_md5 and
+                              int(header['SIZE']) >= 0 and
+                              int(header['SHARD_SIZE']) > 0 and
+                              int(header['DATA_SHARDS']) == k and
+                              int(header['PARITY_SHARDS']) == m and
+                              len(header['SHARD']) == k + m)
+            except (ValueError, IndexError, KeyError, UnicodeDecodeError):
+                up_to_date = False
+            if up_to_date:
+                continue
+        if options.verbose:
+            do_print('parity ' + tar_fpath)
+        if write_parity_file(options, gf, tar_fpath):
+            counter += 1
+        else:
+            fails.append(tar_fpath)
+
+    do_print('Wrote {} parity files.'.format(counter))
+    if len(fails) > 0:
+        for i in fails:
+            do_print('md5sum fail for {}'.format(i))
+        msg = 'no parity written for {} archives that failed the md5sum check'
+        exit_error(msg.format(len(fails)))
+
+
+# rebuild an archive from its intact data and parity shards, returns
+# None on success or the reason why the archive could not be repaired
+def repair_archive(gf, tar_fpath):
+    parity_fpath = tar_fpath + PARITY_EXTENSION
+    if os.path.exists(parity_fpath) is False:
+        return 'no parity file'
+    # without its checksum the archive belongs to a job that has not run
+    if os.path.exists(tar_fpath + '.md5') is False:
+        return 'no md5 file, the backup job has not been executed'
+    try:
+        header, parity_offset = read_parity_header(parity_fpath)
+        size = int(header['SIZE'])
+    except (ValueError, IndexError, KeyError, UnicodeDecodeError):
+        return 'the parity file header is damaged'
+    tar_size = 0
+    tar_ip = None
+    if os.path.exists(tar_fpath):
+        tar_size = min(size, os.path.getsize(tar_fpath))
+        tar_ip = open(tar_fpath, 'rb')
+    try:
+        return _repair_archive(gf, tar_fpath, tar_ip, tar_size, header,
+                               parity_offset)
+    finally:
+        if tar_ip is not None:
+            tar_ip.close()
+
+
+def _repair_archive(gf, tar_fpath, tar_ip, tar_size, header, parity_offset):
+    parity_fpath = tar_fpath + PARITY_EXTENSION
+    size = int(header['SIZE'])
+    k = int(header['DATA_SHARDS'])
+    m = int(header['PARITY_SHARDS'])
+    shard_size = int(header['SHARD_SIZE'])
+
+    # find the intact shards
+    hashes = [hashlib.blake2b() for i in range(k + m)]
+    with open(parity_fpath, 'rb') as ip:
+        for offset in range(0, shard_size, PARITY_BLOCK_SIZE):
+            length = min(PARITY_BLOCK_SIZE, shard_size - offset)
+            data = read_data_block(gf, tar_ip, tar_size, shard_size,
+                                   offset, length, k)
+            for i in range(k):
+                hashes[i].update(data[i].tobytes())
+            for i in range(m):
+                ip.seek(parity_offset + i * shard_size + offset)
+                hashes[k + i].update(ip.read(length))
+    intact = [i for i in range(k + m)
+              if hashes[i].hexdigest() == header['SHARD'].get(i)]
+    damaged = [i for i in range(k) if i not in intact]
+    if len(intact) < k:
+        msg = '{} of {} shards are damaged, at most {} can be repaired'
+        return msg.format(k + m - len(intact), k + m, m)
+    # only an archive with trailing bytes can be fixed without rebuilding
+    # a shard, otherwise its md5 file does not belong to the parity file
+    if len(damaged) == 0 and tar_ip is not None and \
+            os.path.getsize(tar_fpath) == size:
+        return 'no shard is damaged, the md5 file does not match the archive'
+
+    # decode the damaged data shards from the first k intact shards
+    cauchy = gf.cauchy_matrix(k, m)
+    used = intact[:k]
+    rows = []
+    for i in used:
+        if i < k:
+            rows.append([int(i == j) for j in range(k)])
+        else:
+            rows.append(cauchy[i - k])
+    decode = gf.invert_matrix(rows)
+    decode = [decode[i] for i in damaged]
+
+    archive_md5 = hashlib.md5()
+    tmp_fpath = tar_fpath + '.repair'
+    with open(parity_fpath, 'rb') as ip, open(tmp_fpath, 'wb') as op:
+        for offset in range(0, shard_size, PARITY_BLOCK_SIZE):
+            length = min(PARITY_BLOCK_SIZE, shard_size - offset)
+            data = read_data_block(gf, tar_ip, tar_size, shard_size,
+                                   offset, length, k)
+            shards = gf.np.zeros((k, length), dtype=gf.np.uint8)
+            for row, i in enumerate(used):
+                if i < k:
+                    shards[row] = data[i]
+                else:
+                    ip.seek(parity_offset + (i - k) * shard_size + offset)
+                    shards[row] = gf.np.frombuffer(ip.read(length),
+                                                   dtype=gf.np.uint8)
+            rebuilt = gf.matmul(decode, shards)
+            for row, i in enumerate(damaged):
+                data[i] = rebuilt[row]
+            for i in range(k):
+                start = i * shard_size + offset
+                if start >= size:
+                    continue
+                block = data[i, :min(length, size - start)].tobytes()
+                op.seek(start)
+                op.write(block)
+    with open(tmp_fpath, 'rb') as ip:
+        while True:
+            block = ip.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            archive_md5.update(block)
+    if archive_md5.hexdigest() != header['ARCHIVE_MD5']:
+        os.remove(tmp_fpath)
+        return 'the rebuilt archive does not match the recorded md5sum'
+
+    os.replace(tmp_fpath, tar_fpath)
+    md5file(tar_fpath)
+    return None
+
+
+def repair_backups(options):
+    check_dir_existence(options, 'destination', True)
+    verify_catalog(options)
+    gf = GF256()
+    do_print('Repairing the damaged archives from their parity files.')
+
+    counter = 0
+    fails = []
+    for tar_fpath in list_archives(options):
+        if md5check(tar_fpath):
+            continue
+        reason = repair_archive(gf, tar_fpath)
+        if reason is None:
+            counter += 1
+            do_print('repaired {}'.format(tar_fpath))
+        else:
+            fails.append((tar_fpath, reason))
+
+    do_print('Repaired {} archives.'.format(counter))
+    if len(fails) > 0:
+        for i, reason in fails:
+            do_print('could not repair {}: {}'.format(i, reason))
+        msg = '{} archives could not be repaired.\nRepair: FAILURE'
+        exit_error(msg.format(len(fails)))
+    do_print('Repair: SUCCESS')
     return 0
 
 
@@ -485,9 +2070,8 @@ def list_loc_files(catalog_fpath):
 
 
 def verify_locfile_backup(loc_fpath):
-    tar_fpath = loc_fpath[:-len(LOCFILE_EXTENSION)] + COMPRESSED_EXTENSION
     fails = []
-    for i in (loc_fpath, tar_fpath):
+    for i in [loc_fpath] + get_loc_archives(loc_fpath):
         ok = md5check(i)
         if not ok:
             fails.append(i)
@@ -567,13 +2151,14 @@ def check_todo(options):
     script_dir_done = os.sep.join((options.destination,
                                    JOBS_DONE_SUBFOLDER_NAME))
 
+    loc_dir = os.sep.join((refdir_catalog, FILES_SUBFOLDER_NAME))
+
     counter = 0
     loc_files = list_loc_files(catalog_fpath)
     for fpath in loc_files:
         if options.verbose:
             do_print('Check ' + fpath)
-        fname = os.path.basename(fpath)
-        script_fname = fname[:-len(LOCFILE_EXTENSION)] + '.sh'
+        script_fname = get_script_relpath(os.path.relpath(fpath, loc_dir))
         script_fpath_todo = os.sep.join((script_dir_todo,
                                          script_fname))
         script_fpath_done = os.sep.join((script_dir_done,
@@ -583,6 +2168,7 @@ def check_todo(options):
 
         n_files_not_ok = len(list_fun(options, loc_fpath=fpath))
         if n_files_not_ok == 0:
+            makedirs_for(script_fpath_done)
             ok = subprocess.call(['mv',
                                   script_fpath_todo,
                                   script_fpath_done])
@@ -593,10 +2179,7 @@ def check_todo(options):
     msg = msg.format(counter, script_dir_todo, script_dir_done)
     do_print(msg)
 
-    counter = 0
-    for fname in os.listdir(script_dir_todo):
-        if fname.endswith('.sh'):
-            counter += 1
+    counter = len(list_job_scripts(script_dir_todo))
     msg = '{} scripts left in \n"{}"'
     msg = msg.format(counter, script_dir_todo)
     do_print(msg)
@@ -685,10 +2268,11 @@ def restore_from_backup(options):
     # make the restore script files
     loc_files = list_loc_files(catalog_fpath)
     root_dir = get_root_dir(catalog_fpath)
+    loc_dir = os.sep.join((options.source, FILES_SUBFOLDER_NAME))
     counter = 0
     for loc_fpath, source_path in loc_files.items():
-        loc_fname = loc_fpath.split(os.sep)[-1]
-        tar_fpath = loc_fpath[:-len(LOCFILE_EXTENSION)] + COMPRESSED_EXTENSION
+        loc_fname = os.path.relpath(loc_fpath, loc_dir)
+        tar_fpaths = get_loc_archives(loc_fpath)
         destination_relative_dir = source_path.split(root_dir, 1)[-1]
         destination_dir = os.sep.join((options.destination,
                                        destination_relative_dir))
@@ -697,17 +2281,18 @@ def restore_from_backup(options):
             destination_dir = destination_dir.replace(double_sep,
                                                       os.sep)
 
-        restore_script = make_restore_script(fpath=tar_fpath,
+        restore_script = make_restore_script(fpaths=tar_fpaths,
                                              destination_dir=destination_dir)
         if options.verbose:
-            do_print('restore "{}" to "{}"'.format(tar_fpath,
+            do_print('restore "{}" to "{}"'.format(', '.join(tar_fpaths),
                                                    destination_dir))
             do_print(restore_script + '\n')
 
-        script_fname = loc_fname[:-len(LOCFILE_EXTENSION)] + '.sh'
+        script_fname = get_script_relpath(loc_fname)
         script_fpath = os.sep.join((options.destination,
                                     JOBS_TODO_SUBFOLDER_NAME,
                                     script_fname))
+        makedirs_for(script_fpath)
         with open(script_fpath, 'w') as op:
             op.write(restore_script)
         counter += 1
@@ -799,6 +2384,24 @@ def main():
     elif options.verify_restore:
         verify_restore(options)
 
+    elif options.watch:
+        watch_source(options)
+
+    elif options.build_merkle:
+        build_merkle_tree(options)
+
+    elif options.compare_merkle is not None:
+        compare_merkle_trees(options)
+
+    elif options.split_jobs is not None:
+        split_jobs(options)
+
+    elif options.make_parity:
+        make_parity(options)
+
+    elif options.repair:
+        repair_backups(options)
+
     elif options.backup:
         prepare_backups(options)
         if options.no_interactive: